@@ -23,5 +23,5 @@ setup(
     packages = ['vc3remotemanager'],
     package_data={'vc3remotemanager': extra_files},
     include_package_data=True,
-    scripts = ['scripts/vc3-remote-manager'],
+    scripts = ['scripts/vc3-remote-manager', 'scripts/vc3-remote-fleet'],
     )
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from vc3remotemanager.bosco import Bosco
+
+class FakeCluster(object):
+    def resolve_path(self, path):
+        return path
+
+class BlahpExtractTest(unittest.TestCase):
+    distro  = "test"
+    version = "1.2.10"
+    cdir    = "condor-8.6.6-x86_64_test-stripped"
+    files   = [
+        "lib/libclassad.so.8.6.6",
+        "lib/libclassad.so.8",
+        "lib/libclassad.so",
+        "lib/libcondor_utils_8_6_6.so",
+        "lib/condor/libexpat.so.1",
+        "libexec/glite/bin/blah_common_submit_functions.sh",
+        "libexec/glite/etc/blah.config.template",
+        "sbin/condor_ft-gahp",
+    ]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tmp, "cache")
+        os.makedirs(os.path.join(self.cachedir, self.version))
+        self.bosco = Bosco(Cluster=FakeCluster(), cachedir=self.cachedir, version=self.version)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_tarball(self, files):
+        src = os.path.join(self.tmp, "src")
+        for f in files + ["bin/condor_submit"]:
+            path = os.path.join(src, self.cdir, f)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fh:
+                fh.write(f)
+        tarball = os.path.join(self.cachedir, self.version,
+                               "bosco-1.2-x86_64_" + self.distro + ".tar.gz")
+        with tarfile.open(tarball, "w:gz") as t:
+            t.add(os.path.join(src, self.cdir), arcname=self.cdir)
+        return tarball
+
+    def break_index(self, tarball):
+        # a plain file where the index directory should go makes build() fail
+        open(os.path.join(os.path.dirname(tarball), ".index"), 'w').close()
+
+    def check_layout(self, bdir):
+        moved = {
+            "lib/": "bosco/glite/lib/",
+            "libexec/glite/bin/": "bosco/glite/bin/",
+            "libexec/glite/etc/": "bosco/glite/etc/",
+            "sbin/": "bosco/glite/bin/",
+        }
+        for f in self.files:
+            for a, b in moved.items():
+                if f.startswith(a):
+                    dst = b + f[len(a):]
+                    break
+            with open(os.path.join(bdir, dst)) as fh:
+                self.assertEqual(fh.read(), f)
+        self.assertTrue(os.path.isdir(os.path.join(bdir, "bosco/sandbox")))
+        self.assertFalse(os.path.exists(os.path.join(bdir, self.cdir)))
+        self.assertFalse(os.path.exists(os.path.join(bdir, "bosco/glite/bin/condor_submit")))
+
+    def test_indexed(self):
+        self.make_tarball(self.files)
+        bdir = self.bosco.extract_blahp(self.distro)
+        try:
+            self.check_layout(bdir)
+        finally:
+            shutil.rmtree(bdir)
+
+    def test_streaming_fallback(self):
+        self.break_index(self.make_tarball(self.files))
+        bdir = self.bosco.extract_blahp(self.distro)
+        try:
+            self.check_layout(bdir)
+        finally:
+            shutil.rmtree(bdir)
+
+    def test_streaming_fallback_missing_file(self):
+        files = [f for f in self.files if f != "sbin/condor_ft-gahp"]
+        self.break_index(self.make_tarball(files))
+        with self.assertRaises(KeyError) as cm:
+            self.bosco.extract_blahp(self.distro)
+        self.assertIn("sbin/condor_ft-gahp", str(cm.exception))
+        self.assertIn("not found", str(cm.exception))
+
+if __name__ == '__main__':
+    unittest.main()
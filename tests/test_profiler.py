@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from vc3remotemanager.bosco import Bosco
+from vc3remotemanager.profiler import PhaseProfiler
+from vc3remotemanager.scheduler import Scheduler
+
+def spin_in_step(n):
+    total = 0
+    for i in range(n):
+        total += i * i
+    return total
+
+def spin_in_phase(n):
+    return spin_in_step(n)
+
+class FakeCluster(object):
+    def resolve_path(self, path):
+        return path
+
+    def resolve_platform(self):
+        spin_in_step(200000)
+        return "RedHat7"
+
+class FakeSSH(object):
+    host = "localhost"
+
+class PhaseProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def report(self, name):
+        with open(os.path.join(self.tmp, name + ".cpu.txt")) as f:
+            return f.read()
+
+    def test_cpu_phase(self):
+        p = PhaseProfiler(mode='cpu', outdir=self.tmp)
+        with p.phase("work"):
+            spin_in_phase(100000)
+        self.assertIn("spin_in_phase", self.report("work"))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, "work.prof")))
+
+    def test_cpu_phase_sees_scheduler_threads(self):
+        p = PhaseProfiler(mode='cpu', outdir=self.tmp)
+        s = Scheduler(timeout=10)
+        with p.phase("work"):
+            step = p.wrap(spin_in_step)
+            s.call("site", ["localhost"], lambda host: step(200000))
+        self.assertIn("spin_in_step", self.report("work"))
+
+    def test_bosco_remote_step_profiled(self):
+        p = PhaseProfiler(mode='cpu', outdir=self.tmp)
+        b = Bosco(Cluster=FakeCluster(), SSHManager=FakeSSH(), profiler=p,
+                  scheduler=Scheduler(timeout=10), cachedir=self.tmp)
+        with p.phase("lookup"):
+            self.assertEqual(b.remote(b.cluster.resolve_platform), "RedHat7")
+        report = self.report("lookup")
+        self.assertIn("resolve_platform", report)
+        self.assertIn("spin_in_step", report)
+
+    def test_wrap_outside_phase(self):
+        p = PhaseProfiler(mode='cpu', outdir=self.tmp)
+        self.assertTrue(p.wrap(spin_in_step) is spin_in_step)
+        self.assertTrue(PhaseProfiler().wrap(spin_in_step) is spin_in_step)
+
+    def test_summary_after_failure(self):
+        p = PhaseProfiler(mode='cpu', outdir=self.tmp)
+        with p.phase("ok"):
+            pass
+        try:
+            with p.phase("broken"):
+                raise IOError("boom")
+        except IOError:
+            pass
+        with open(p.summary()) as f:
+            lines = f.read().splitlines()
+        self.assertEqual([l.split()[0] for l in lines[1:]], ["ok", "broken"])
+
+if __name__ == '__main__':
+    unittest.main()
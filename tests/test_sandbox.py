@@ -0,0 +1,108 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from vc3remotemanager.sandbox import SandboxPruner
+
+class LocalSSH(object):
+    """
+    Stand-in for SSHManager that runs commands on this machine
+    """
+    host = "localhost"
+
+    def remote_exec(self, cmd):
+        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        return p.returncode, out.decode('utf-8').rstrip(), err.decode('utf-8').rstrip()
+
+def usage(path):
+    """
+    Return (kb, inodes) for path and everything under it, as find -printf %k
+    counts them
+    """
+    paths = [path]
+    for root, dirs, files in os.walk(path):
+        paths.extend(os.path.join(root, name) for name in dirs + files)
+    return sum((os.lstat(p).st_blocks + 1) // 2 for p in paths), len(paths)
+
+class SandboxPrunerTest(unittest.TestCase):
+    jobs = ["7.0", "job with spaces", "it's old", "fresh"]
+    old  = ["7.0", "job with spaces", "it's old"]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.sandbox = os.path.join(self.tmp, "sandbox")
+        for job in self.jobs:
+            d = os.path.join(self.sandbox, job, "out")
+            os.makedirs(d)
+            for i in range(3):
+                with open(os.path.join(d, "f%d" % i), 'w') as f:
+                    f.write("x" * 5000 * (i + 1))
+        then = time.time() - 40 * 86400
+        for job in self.old:
+            os.utime(os.path.join(self.sandbox, job), (then, then))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def pruner(self, **kwargs):
+        return SandboxPruner(sandbox=self.sandbox, days=30, **kwargs)
+
+    def expected(self):
+        kb = inodes = pkb = pinodes = 0
+        for job in os.listdir(self.sandbox):
+            k, i = usage(os.path.join(self.sandbox, job))
+            kb += k
+            inodes += i
+            if job in self.old:
+                pkb += k
+                pinodes += i
+        return {
+            'bytes':          kb * 1024,
+            'inodes':         inodes,
+            'entries':        len(self.jobs),
+            'pruned_bytes':   pkb * 1024,
+            'pruned_inodes':  pinodes,
+            'pruned_entries': len(self.old),
+        }
+
+    def test_dry_run(self):
+        expected = self.expected()
+        self.assertEqual(expected['pruned_inodes'], 3 * 5)
+        self.assertEqual(self.pruner(dryrun=True).prune(LocalSSH()), expected)
+        self.assertEqual(sorted(os.listdir(self.sandbox)), sorted(self.jobs))
+
+    def test_prune(self):
+        expected = self.expected()
+        self.assertEqual(self.pruner(rate=2).prune(LocalSSH()), expected)
+        self.assertEqual(os.listdir(self.sandbox), ["fresh"])
+
+        again = self.pruner().prune(LocalSSH())
+        self.assertEqual(again['entries'], 1)
+        self.assertEqual(again['pruned_entries'], 0)
+        self.assertEqual(again['pruned_bytes'], 0)
+
+    def test_missing_sandbox(self):
+        p = SandboxPruner(sandbox=os.path.join(self.tmp, "nowhere"))
+        status, out, _ = LocalSSH().remote_exec(p.command())
+        self.assertEqual(status, 3)
+        self.assertIsNone(p.report(out))
+        self.assertIsNone(p.prune(LocalSSH()))
+
+    def test_report(self):
+        out = "some login banner\nvc3-sandbox 10 20 3 4 5 1"
+        self.assertEqual(self.pruner().report(out), {
+            'bytes':          10240,
+            'inodes':         20,
+            'entries':        3,
+            'pruned_bytes':   4096,
+            'pruned_inodes':  5,
+            'pruned_entries': 1,
+        })
+        self.assertRaises(ValueError, self.pruner().report, "no report here")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from vc3remotemanager.scheduler import CircuitBreaker, CircuitOpenError, Scheduler, StepTimeout
+
+class Flaky(object):
+    """
+    Step that fails the first `failures` calls, recording every host it ran on
+    """
+    def __init__(self, failures=0, delay=None):
+        self.failures = failures
+        self.delay    = delay or {}
+        self.calls    = []
+        self.lock     = threading.Lock()
+
+    def __call__(self, host):
+        with self.lock:
+            self.calls.append(host)
+            n = len(self.calls)
+        time.sleep(self.delay.get(host, 0))
+        if n <= self.failures:
+            raise IOError("refused %d" % n)
+        return "ok from %s" % host
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_opens_after_threshold(self):
+        br = CircuitBreaker(threshold=2, cooldown=100)
+        br.failure('h')
+        self.assertTrue(br.allow('h'))
+        br.failure('h')
+        self.assertFalse(br.available('h'))
+        self.assertFalse(br.allow('h'))
+        br.success('h')
+        self.assertTrue(br.allow('h'))
+
+    def test_half_open_single_trial(self):
+        br = CircuitBreaker(threshold=1, cooldown=0.1)
+        br.failure('h')
+        self.assertFalse(br.allow('h'))
+        time.sleep(0.15)
+        # looking doesn't spend the trial, allowing does
+        self.assertTrue(br.available('h'))
+        self.assertTrue(br.available('h'))
+        self.assertTrue(br.allow('h'))
+        self.assertFalse(br.available('h'))
+        self.assertFalse(br.allow('h'))
+
+    def test_state_survives_restart(self):
+        statefile = os.path.join(self.tmp, "state", "breakers")
+        br = CircuitBreaker(threshold=2, cooldown=100, statefile=statefile)
+        br.failure('bad')
+        br.failure('bad')
+        br.failure('flaky')
+
+        again = CircuitBreaker(threshold=2, cooldown=100, statefile=statefile)
+        self.assertFalse(again.allow('bad'))
+        self.assertTrue(again.allow('flaky'))
+        again.failure('flaky')
+        self.assertFalse(again.allow('flaky'))
+
+    def test_bad_statefile(self):
+        statefile = os.path.join(self.tmp, "breakers")
+        with open(statefile, 'w') as f:
+            f.write("not json")
+        self.assertTrue(CircuitBreaker(statefile=statefile).allow('h'))
+
+class SchedulerTest(unittest.TestCase):
+    def test_success(self):
+        s = Scheduler(timeout=1)
+        self.assertEqual(s.call('site', ['a', 'b'], lambda h: h.upper()), ('a', 'A'))
+
+    def test_retries_with_backoff(self):
+        step = Flaky(failures=2)
+        s = Scheduler(timeout=1, retries=2, backoff=0.1, breaker=CircuitBreaker(threshold=10))
+        start = time.time()
+        self.assertEqual(s.call('site', ['a'], step), ('a', 'ok from a'))
+        # jittered delays of 0.05-0.1s and 0.1-0.2s
+        self.assertTrue(time.time() - start >= 0.15)
+        self.assertEqual(step.calls, ['a', 'a', 'a'])
+
+    def test_backoff_is_capped(self):
+        step = Flaky(failures=2)
+        s = Scheduler(timeout=1, retries=2, backoff=10, maxbackoff=0.05,
+                      breaker=CircuitBreaker(threshold=10))
+        start = time.time()
+        s.call('site', ['a'], step)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_retries_exhausted(self):
+        step = Flaky(failures=5)
+        s = Scheduler(timeout=1, retries=1, backoff=0.01, breaker=CircuitBreaker(threshold=10))
+        with self.assertRaises(IOError) as cm:
+            s.call('site', ['a'], step)
+        self.assertEqual(str(cm.exception), "refused 2")
+
+    def test_step_timeout(self):
+        s = Scheduler(timeout=0.1)
+        start = time.time()
+        with self.assertRaises(StepTimeout):
+            s.call('site', ['a'], lambda h: time.sleep(2))
+        self.assertTrue(time.time() - start < 1)
+
+    def test_deadline_passed(self):
+        step = Flaky()
+        s = Scheduler(timeout=1)
+        with self.assertRaises(StepTimeout):
+            s.call('site', ['a'], step, deadline=time.time() - 1)
+        self.assertEqual(step.calls, [])
+
+    def test_deadline_stops_backoff(self):
+        # no time left to wait out the backoff, so give up instead of sleeping
+        step = Flaky(failures=5)
+        s = Scheduler(timeout=1, retries=5, backoff=10, breaker=CircuitBreaker(threshold=10))
+        start = time.time()
+        with self.assertRaises(IOError):
+            s.call('site', ['a'], step, deadline=time.time() + 0.5)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(step.calls, ['a'])
+
+    def test_deadline_caps_attempt(self):
+        s = Scheduler(timeout=10)
+        start = time.time()
+        with self.assertRaises(StepTimeout):
+            s.call('site', ['a'], lambda h: time.sleep(2), deadline=time.time() + 0.1)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_failover(self):
+        step = Flaky(failures=1)
+        s = Scheduler(timeout=1)
+        self.assertEqual(s.call('site', ['a', 'b'], step), ('b', 'ok from b'))
+        self.assertEqual(step.calls, ['a', 'b'])
+
+    def test_hedge(self):
+        step = Flaky(delay={'a': 1})
+        s = Scheduler(timeout=2, hedge=0.05)
+        start = time.time()
+        self.assertEqual(s.call('site', ['a', 'b'], step), ('b', 'ok from b'))
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_no_hedge_without_alternates_waiting(self):
+        step = Flaky(delay={'a': 0.2})
+        s = Scheduler(timeout=2)
+        self.assertEqual(s.call('site', ['a', 'b'], step), ('a', 'ok from a'))
+        self.assertEqual(step.calls, ['a'])
+
+    def test_open_circuit_skips_host(self):
+        br = CircuitBreaker(threshold=1, cooldown=100)
+        br.failure('a')
+        step = Flaky()
+        s = Scheduler(timeout=1, breaker=br)
+        self.assertEqual(s.call('site', ['a', 'b'], step), ('b', 'ok from b'))
+        self.assertEqual(step.calls, ['b'])
+
+    def test_circuit_open_keeps_last_error(self):
+        s = Scheduler(timeout=1, retries=3, backoff=0.01,
+                      breaker=CircuitBreaker(threshold=2, cooldown=100))
+        with self.assertRaises(CircuitOpenError) as cm:
+            s.call('site', ['a'], Flaky(failures=10))
+        self.assertIn("circuit open for a", str(cm.exception))
+        self.assertIn("refused 2", str(cm.exception))
+
+    def test_half_open_trial_spent_on_launch_only(self):
+        br = CircuitBreaker(threshold=1, cooldown=0.1)
+        br.failure('a')
+        br.failure('b')
+        time.sleep(0.15)
+        s = Scheduler(timeout=1, hedge=1, breaker=br)
+        self.assertEqual(s.call('site', ['a', 'b'], Flaky()), ('a', 'ok from a'))
+        # b was a candidate but never launched, so it still has its trial
+        self.assertTrue(br.available('b'))
+        self.assertTrue(br.allow('b'))
+
+    def test_system_exit_is_not_a_timeout(self):
+        br = CircuitBreaker(threshold=1)
+        s = Scheduler(timeout=5, retries=2, breaker=br)
+        start = time.time()
+        with self.assertRaises(SystemExit):
+            s.call('site', ['a'], lambda h: sys.exit(1))
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue(br.allow('a'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from vc3remotemanager.store import ContentStore
+
+class LocalSFTP(object):
+    def open(self, path, mode='r'):
+        return open(path, mode)
+
+class LocalSSH(object):
+    """
+    Stand-in for SSHManager that runs everything on this machine
+    """
+    host = "localhost"
+
+    def __init__(self):
+        self.sftp = LocalSFTP()
+
+    def remote_exec(self, cmd):
+        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        return p.returncode, out.decode('utf-8').rstrip(), err.decode('utf-8').rstrip()
+
+    def remote_cmd(self, cmd):
+        _, out, err = self.remote_exec(cmd)
+        return out, err
+
+class ContentStoreTest(unittest.TestCase):
+    libs = {
+        "libclassad.so.8": "classad",
+        "libcondor_utils.so": "utils",
+        "condor/libexpat.so.1": "expat",
+    }
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, "store")
+        self.store = ContentStore(SSHManager=LocalSSH(), root=self.root)
+
+    def tearDown(self):
+        # objects are read-only
+        for path, dirs, files in os.walk(self.tmp):
+            for name in dirs + files:
+                if not os.path.islink(os.path.join(path, name)):
+                    os.chmod(os.path.join(path, name), 0o755)
+        shutil.rmtree(self.tmp)
+
+    def bundle(self, name, libs=None):
+        bdir = os.path.join(self.tmp, "bundle-" + name)
+        for rel, contents in (libs or self.libs).items():
+            path = os.path.join(bdir, "bosco", "glite", "lib", rel)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(contents)
+            os.chmod(path, 0o644)
+        os.makedirs(os.path.join(bdir, "bosco", "glite", "bin"))
+        return bdir
+
+    def stage(self, name, libs=None):
+        bdir = self.bundle(name, libs)
+        installdir = os.path.join(self.tmp, "install-" + name)
+        self.store.stage(bdir, installdir)
+        return bdir, installdir
+
+    def upload(self, bdir, installdir):
+        # what the tarball transfer and unpack do on a real site
+        shutil.copytree(bdir, installdir, symlinks=True)
+
+    def install(self, name, libs=None):
+        bdir, installdir = self.stage(name, libs)
+        self.upload(bdir, installdir)
+        self.store.assemble(installdir)
+        return installdir
+
+    def lib(self, installdir, rel):
+        return os.path.join(installdir, "bosco", "glite", "lib", rel)
+
+    def registrations(self):
+        return sorted(os.listdir(os.path.join(self.root, "installs")))
+
+    def test_install_links_objects(self):
+        installdir = self.install("a")
+        objects = os.listdir(os.path.join(self.root, "objects"))
+        self.assertEqual(len(objects), len(self.libs))
+        for rel, contents in self.libs.items():
+            path = self.lib(installdir, rel)
+            with open(path) as f:
+                self.assertEqual(f.read(), contents)
+            st = os.stat(path)
+            self.assertEqual(st.st_nlink, 2)
+            self.assertEqual(st.st_mode & 0o777, 0o444)
+        for name in objects:
+            self.assertTrue(name.endswith("-444"), name)
+
+        self.assertFalse(os.path.exists(os.path.join(installdir, "bosco", ".vc3-objects")))
+        self.assertFalse(os.path.exists(os.path.join(installdir, "bosco", ".vc3-assemble.sh")))
+        regs = self.registrations()
+        self.assertEqual(len(regs), 1)
+        with open(os.path.join(self.root, "installs", regs[0])) as f:
+            self.assertEqual(f.read().strip(), installdir)
+
+    def test_second_install_uploads_nothing(self):
+        a = self.install("a")
+        bdir, b = self.stage("b")
+        objdir = os.path.join(bdir, "bosco", ".vc3-objects")
+        self.assertEqual(os.listdir(objdir), [])
+        self.upload(bdir, b)
+        self.store.assemble(b)
+        for rel in self.libs:
+            self.assertEqual(os.stat(self.lib(a, rel)).st_ino, os.stat(self.lib(b, rel)).st_ino)
+            self.assertEqual(os.stat(self.lib(a, rel)).st_nlink, 3)
+
+    def test_gc(self):
+        a = self.install("a")
+        libs = dict(self.libs)
+        libs["libclassad.so.8"] = "classad, patched"
+        b = self.install("b", libs)
+        self.assertEqual(len(os.listdir(os.path.join(self.root, "objects"))), len(self.libs) + 1)
+
+        # nothing to collect while both installs are around
+        self.assertEqual(self.store.gc(), (0, 0))
+
+        shutil.rmtree(a)
+        self.assertEqual(self.store.gc(), (1, len("classad")))
+        self.assertEqual(len(self.registrations()), 1)
+        for rel, contents in libs.items():
+            with open(self.lib(b, rel)) as f:
+                self.assertEqual(f.read(), contents)
+
+        shutil.rmtree(b)
+        self.assertEqual(self.store.gc()[0], len(self.libs))
+        self.assertEqual(os.listdir(os.path.join(self.root, "objects")), [])
+        self.assertEqual(self.registrations(), [])
+
+    def test_pending_install_survives_gc(self):
+        a = self.install("a")
+        shutil.rmtree(a)
+
+        # b relies on a's objects being there, so it uploads none of its own
+        bdir, b = self.stage("b")
+        self.assertEqual(os.listdir(os.path.join(bdir, "bosco", ".vc3-objects")), [])
+        self.assertEqual(len([r for r in self.registrations() if r.endswith(".pending")]), 1)
+
+        # a gc between staging and assembly must leave them alone
+        self.assertEqual(self.store.gc(), (0, 0))
+
+        self.upload(bdir, b)
+        self.store.assemble(b)
+        self.assertEqual(len(self.registrations()), 1)
+        self.assertFalse(self.registrations()[0].endswith(".pending"))
+        for rel, contents in self.libs.items():
+            with open(self.lib(b, rel)) as f:
+                self.assertEqual(f.read(), contents)
+
+    def test_stale_pending_expires(self):
+        bdir, b = self.stage("a")
+        pending = [r for r in self.registrations() if r.endswith(".pending")]
+        old = os.path.getmtime(os.path.join(self.root, "installs", pending[0])) - 3 * 86400
+        os.utime(os.path.join(self.root, "installs", pending[0]), (old, old))
+        self.store.gc()
+        self.assertEqual(self.registrations(), [])
+
+    def test_missing_object_fails_assembly(self):
+        self.install("a")
+        bdir, b = self.stage("b")
+        self.upload(bdir, b)
+        objects = os.path.join(self.root, "objects")
+        for name in os.listdir(objects):
+            os.chmod(os.path.join(objects, name), 0o644)
+            os.remove(os.path.join(objects, name))
+        with self.assertRaises(IOError):
+            self.store.assemble(b)
+        # no dangling links were made
+        for rel in self.libs:
+            self.assertFalse(os.path.islink(self.lib(b, rel)))
+
+if __name__ == '__main__':
+    unittest.main()
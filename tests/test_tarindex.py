@@ -0,0 +1,69 @@
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from vc3remotemanager.tarindex import TarIndex
+
+class TarIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        os.makedirs(os.path.join(self.src, "c", "lib"))
+
+        # mix incompressible and highly compressible members so capped
+        # inflate calls land on chunk boundaries in every possible way
+        rng = random.Random(42)
+        for i in range(80):
+            size = rng.randint(0, 400000)
+            if i % 3 == 0:
+                data = bytearray(rng.getrandbits(8) for _ in range(size))
+            else:
+                data = bytearray([i % 256]) * size
+            with open(os.path.join(self.src, "c", "lib", "f%02d.so" % i), 'wb') as f:
+                f.write(bytes(data))
+        os.symlink("f01.so", os.path.join(self.src, "c", "lib", "link.so"))
+
+        self.tarball = os.path.join(self.tmp, "bosco.tar.gz")
+        with tarfile.open(self.tarball, "w:gz") as t:
+            t.add(os.path.join(self.src, "c"), arcname="c")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_round_trip(self):
+        for chunksize in (64 * 1024, 100000, 1024 * 1024):
+            idx = TarIndex(self.tarball, chunksize=chunksize,
+                           indexdir=os.path.join(self.tmp, "idx%d" % chunksize))
+            idx.build()
+
+            loaded = TarIndex(self.tarball, indexdir=idx.indexdir)
+            self.assertTrue(loaded.load())
+
+            out = os.path.join(self.tmp, "out%d" % chunksize)
+            loaded.extract(loaded.names(), out)
+
+            for name in loaded.names():
+                a = os.path.join(self.src, name)
+                b = os.path.join(out, name)
+                if os.path.islink(a):
+                    self.assertEqual(os.readlink(a), os.readlink(b))
+                elif os.path.isfile(a):
+                    with open(a, 'rb') as fa:
+                        with open(b, 'rb') as fb:
+                            self.assertEqual(fa.read(), fb.read(), name)
+
+    def test_stale_index(self):
+        idx = TarIndex(self.tarball)
+        self.assertFalse(idx.load())
+        idx.build()
+        self.assertTrue(TarIndex(self.tarball).load())
+
+        st = os.stat(self.tarball)
+        os.utime(self.tarball, (st.st_atime, st.st_mtime + 10))
+        self.assertFalse(TarIndex(self.tarball).load())
+
+if __name__ == '__main__':
+    unittest.main()
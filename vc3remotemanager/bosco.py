@@ -6,11 +6,15 @@ import logging
 import os
 import re
 import shutil
-import sys
 import tarfile
 import tempfile
 import textwrap
 
+from vc3remotemanager.profiler import PhaseProfiler
+from vc3remotemanager.sandbox import SandboxPruner
+from vc3remotemanager.store import ContentStore
+from vc3remotemanager.tarindex import TarIndex
+
 try:
     from urllib.parse import urlparse
 except ImportError:
@@ -30,17 +34,18 @@ class Bosco(object):
         self.patchset    = kwargs.get('patchset', None)
         self.rdistro     = kwargs.get('rdistro', None)
         self.clusterlist = kwargs.get('clusterlist', None)
+        self.store       = kwargs.get('store', None) # shared content store, None to disable
+        self.profiler    = kwargs.get('profiler', None) or PhaseProfiler()
+        self.scheduler   = kwargs.get('scheduler', None) # timeouts/retries for remote lookups, None to run them directly
+        self.timeout     = kwargs.get('timeout', None) # FTP timeout in seconds
         self.log         = logging.getLogger(__name__)
 
         try:
-            self.installdir = self.cluster.resolve_path(self.installdir) # is this bad?
+            self.installdir = self.remote(self.cluster.resolve_path, self.installdir) # is this bad?
             self.log.debug("Installdir is %s" % self.installdir)
         except Exception as e:
-            self.log.warn("Couldn't resolve installdir.. %s" % e)
-            sys.exit(1) # we should probably cowardly bail out here
-            #self.installdir = installdir
-
-            self.clusterlist = os.path.join(self.cachedir, ".clusterlist")
+            self.log.error("Couldn't resolve installdir.. %s" % e)
+            raise # let the caller decide whether to bail out or try elsewhere
 
         if self.sandbox is None:
             self.sandbox = os.path.join(self.installdir,"bosco/sandbox")
@@ -51,6 +56,10 @@ class Bosco(object):
         if self.clusterlist is None:
             self.clusterlist = os.path.join(self.cachedir, ".clusterlist")
 
+        if self.store is not None:
+            self.store = self.remote(self.cluster.resolve_path, self.store)
+            self.log.debug("Content store is %s" % self.store)
+
         if self.lrms is None:
             self.log.debug("Missing required option lrms: %s" % self.lrms)
         if self.cluster is None:
@@ -60,13 +69,30 @@ class Bosco(object):
 
         self.etcdir = self.installdir + "/bosco/glite/etc"
 
+    def remote(self, fn, *args):
+        """
+        Run a remote lookup through the scheduler, retrying it if it hangs
+        or fails. Only for steps that are safe to repeat: an attempt that
+        times out keeps running in the background. Everything else relies
+        on the SSH channel timeouts.
+        """
+        if self.scheduler is None:
+            return fn(*args)
+        # the step runs on a scheduler thread, out of sight of cProfile
+        step = self.profiler.wrap(fn)
+        _, result = self.scheduler.call(self.ssh.host, [self.ssh.host], lambda host: step(*args))
+        return result
+
     def cache_tarballs(self):
         r = urlparse(self.repository)
         path = r.path + "/" + self.version
         self.log.debug("repo is %s " % r.netloc)
         self.log.debug("path is %s " % path)
 
-        ftp = FTP(r.netloc)
+        if self.timeout is not None:
+            ftp = FTP(r.netloc, timeout=self.timeout)
+        else:
+            ftp = FTP(r.netloc)
         ftp.login()
         ftp.cwd(path)
         files = ftp.nlst()
@@ -119,18 +145,40 @@ class Bosco(object):
             'libexec/glite/bin',
             'libexec/glite/etc' ]
 
-        # open the tarball, extract blahp_files and blahp_dirs to tmp
-        with TarFile.open(tarfile) as t:
-            members = []
-            for f in blahp_files:
-                members.append(t.getmember(os.path.join(cdir,f)))
-            for d in blahp_dirs:
-                match = os.path.join(cdir, d)
-                files = [t.getmember(s) for s in t.getnames() if re.match(match, s)]
-                members.extend(files)
-
-            #self.log.debug("Extracting %s to %s" % (members, tempdir))
-            t.extractall(tempdir,members)
+        # index the tarball the first time this distro is installed, so
+        # later extractions only inflate the members we actually ship. If
+        # that fails, stream the tarball once for blahp_files and blahp_dirs
+        idx = TarIndex(tarfile)
+        indexed = idx.load()
+        if not indexed:
+            self.log.info("Indexing %s" % os.path.basename(tarfile))
+            try:
+                idx.build()
+                indexed = True
+            except Exception as e:
+                self.log.warn("Couldn't index %s, falling back to a full scan" % tarfile)
+                self.log.debug(e)
+
+        if indexed:
+            names = self.blahp_members(cdir, idx.names(), blahp_files, blahp_dirs)
+            self.log.debug("Extracting %d indexed members to %s" % (len(names), tempdir))
+            idx.extract(names, tempdir)
+        else:
+            wanted = set(os.path.join(cdir,f) for f in blahp_files)
+            matches = [os.path.join(cdir, d) for d in blahp_dirs]
+            found = set()
+            with TarFile.open(tarfile, 'r|gz') as t:
+                m = t.next()
+                while m is not None:
+                    if m.name in wanted or any(re.match(match, m.name) for match in matches):
+                        t.extract(m, tempdir)
+                        found.add(m.name)
+                    # don't hold on to every header we stream past
+                    t.members = []
+                    m = t.next()
+            missing = wanted - found
+            if missing:
+                raise KeyError("filename %r not found" % missing.pop())
 
         # once things are in tmp, we need to need to move things around and
         # make some directories
@@ -157,6 +205,21 @@ class Bosco(object):
 
         return tempdir
 
+    def blahp_members(self, cdir, names, blahp_files, blahp_dirs):
+        """
+        Select the tarball members that make up the BLAHP
+        """
+        members = []
+        for f in blahp_files:
+            name = os.path.join(cdir,f)
+            if name not in names:
+                raise KeyError("filename %r not found" % name)
+            members.append(name)
+        for d in blahp_dirs:
+            match = os.path.join(cdir, d)
+            members.extend([s for s in names if re.match(match, s)])
+        return members
+
     def create_tarball(self, dst, src):
         outfile = dst + ".tar.gz"
         with tarfile.open(outfile, "w:gz") as tar:
@@ -174,8 +237,8 @@ class Bosco(object):
         #ENABLE_URL_TRANSFERS = False
         #EOF
 
-        installpath = self.cluster.resolve_path(self.installdir)
-        sandboxpath = self.cluster.resolve_path(self.sandbox)
+        installpath = self.remote(self.cluster.resolve_path, self.installdir)
+        sandboxpath = self.remote(self.cluster.resolve_path, self.sandbox)
 
         config = """\
             BOSCO_SANDBOX_DIR=%s
@@ -210,12 +273,12 @@ class Bosco(object):
         try:
             os.stat(p)
             t = self.create_tarball(os.path.join(tempdir,self.patchset), os.path.join(p,"glite"))
-            dst = self.cluster.resolve_path(self.installdir + "/bosco/") + os.path.basename(t)
+            dst = self.remote(self.cluster.resolve_path, self.installdir + "/bosco/") + os.path.basename(t)
 
             self.log.debug("Source is %s, Destination is %s" % (t,dst))
             try:
                 self.ssh.sftp.put(t, dst)
-                _, err =self.ssh.remote_cmd("tar -xzf " + dst + " -C " + self.installdir + "/bosco" )
+                _, err = self.ssh.remote_cmd("tar -xzf " + dst + " -C " + self.installdir + "/bosco" )
                 if err is not '':
                     self.log.debug(err)
             except:
@@ -228,61 +291,97 @@ class Bosco(object):
             self.log.debug("Couldn't open the patchset %s, something probably went wrong..." % p)
 
     def setup_bosco(self):
-        self.log.info("Retrieving BOSCO tarballs from FTP...")
-        self.cache_tarballs()
+        try:
+            with self.profiler.phase("cache"):
+                self.log.info("Retrieving BOSCO tarballs from FTP...")
+                self.cache_tarballs()
 
-        if self.rdistro is not None:
-            distro = self.rdistro
-        else:
-            self.log.debug("No distro override configured, proceeding as normal...")
-            distro = self.cluster.resolve_platform()
+            if self.rdistro is not None:
+                distro = self.rdistro
+            else:
+                self.log.debug("No distro override configured, proceeding as normal...")
+                distro = self.remote(self.cluster.resolve_platform)
+
+            with self.profiler.phase("extract"):
+                self.log.info("Extracting BOSCO files for platform %s" % distro)
+                bdir = self.extract_blahp(distro)
+            if self.tag is not None:
+                tarname = "bosco" + "-" + self.tag
+            else:
+                tarname = "bosco"
+
+            # pull shared libraries out of the bundle, only shipping those the
+            # site's content store doesn't already have
+            if self.store is not None:
+                with self.profiler.phase("stage"):
+                    cstore = ContentStore(SSHManager=self.ssh, root=self.store)
+                    cstore.stage(bdir, self.installdir)
+
+            with self.profiler.phase("bundle"):
+                self.log.info("Creating new BOSCO tarball for target %s" % self.ssh.host)
+                t = self.create_tarball(tarname, os.path.join(bdir,"bosco"))
+                self.log.debug("t is %s" % t)
+
+            with self.profiler.phase("transfer"):
+                src = os.path.join(os.getcwd(),t)
+                dst = self.remote(self.cluster.resolve_path, self.installdir + "/" + t)
+                self.log.info("Transferring %s to %s" % (src, dst))
+                try:
+                    self.ssh.sftp.mkdir(self.remote(self.cluster.resolve_path, self.installdir))
+                except IOError as e:
+                    self.log.debug("Couldn't create installdir.. perhaps it already exists?")
+                try:
+                    self.ssh.sftp.put(src, dst)
+                except Exception as e:
+                    self.log.error("Couldn't transfer %s to %s!" % (src, self.ssh.host + ":" + dst))
+                    self.log.debug(e)
+                    raise
+
+            with self.profiler.phase("unpack"):
+                self.log.info("Extracting %s to %s" % ((self.ssh.host + ":" + dst),self.installdir))
+                _, err = self.ssh.remote_cmd("tar -xzf " + dst + " -C " + self.installdir )
+                if err is not '':
+                    self.log.debug(err)
+                self.log.info("Deleting temporary file %s" % dst)
+                self.ssh.sftp.remove(dst)
 
-        self.log.info("Extracting BOSCO files for platform %s" % distro)
-        bdir = self.extract_blahp(distro)
-        if self.tag is not None:
-            tarname = "bosco" + "-" + self.tag
-        else:
-            tarname = "bosco"
+                if self.store is not None:
+                    cstore.assemble(self.installdir)
 
-        self.log.info("Creating new BOSCO tarball for target %s" % self.ssh.host)
-        t = self.create_tarball(tarname, os.path.join(bdir,"bosco"))
-        self.log.debug("t is %s" % t)
+            with self.profiler.phase("configure"):
+                # configure file transfer gahp daemon
+                self.config_ft_gahp()
 
-        src = os.path.join(os.getcwd(),t)
-        dst = self.cluster.resolve_path(self.installdir + "/" + t)
-        self.log.info("Transferring %s to %s" % (src, dst))
-        try:
-            self.ssh.sftp.mkdir(self.cluster.resolve_path(self.installdir))
-        except IOError as e:
-            self.log.debug("Couldn't create installdir.. perhaps it already exists?")
-        try:
-            self.ssh.sftp.put(src, dst)
-        except Exception as e:
-            self.log.error("Couldn't transfer %s to %s!" % (src, self.ssh.host + ":" + dst))
-            self.log.debug(e)
-            raise
-
-        self.log.info("Extracting %s to %s" % ((self.ssh.host + ":" + dst),self.installdir))
-        _, err = self.ssh.remote_cmd("tar -xzf " + dst + " -C " + self.installdir )
-        if err is not '':
-            self.log.debug(err)
-        self.log.info("Deleting temporary file %s" % dst)
-        self.ssh.sftp.remove(dst)
-
-        # configure file transfer gahp daemon
-        self.config_ft_gahp()
-
-        # apply patches for the site
-        if self.patchset is not None:
-            self.apply_patches(bdir)
-        else:
-            self.log.debug("No patches to apply, moving on...")
+                # apply patches for the site
+                if self.patchset is not None:
+                    self.apply_patches(bdir)
+                else:
+                    self.log.debug("No patches to apply, moving on...")
+
+                self.add_cluster()
+
+            # cleanup tempfile
+            self.log.info("Cleaning up tempdir %s" % bdir)
+            shutil.rmtree(bdir)
+        finally:
+            # leave a report behind for failed installs too
+            self.profiler.summary()
 
-        self.add_cluster()
+    def gc_store(self):
+        """
+        Delete content store objects no longer used by any install
+        """
+        if self.store is None:
+            self.log.debug("No content store configured, nothing to collect")
+            return
+        ContentStore(SSHManager=self.ssh, root=self.store).gc()
 
-        # cleanup tempfile
-        self.log.info("Cleaning up tempdir %s" % bdir)
-        shutil.rmtree(bdir)
+    def prune_sandbox(self, days, dryrun=False, rate=0):
+        """
+        Report sandbox usage and remove job directories older than days
+        """
+        p = SandboxPruner(sandbox=self.sandbox, days=days, dryrun=dryrun, rate=rate)
+        return p.prune(self.ssh)
 
     def add_cluster(self):
         openMode = 'a+'
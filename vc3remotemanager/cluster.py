@@ -2,7 +2,6 @@ import logging
 import os
 import re
 import shlex
-import sys
 
 class Cluster(object):
     def __init__(self, SSHManager):
@@ -45,7 +44,7 @@ class Cluster(object):
                 self.log.debug("Couldn't open %s, continuing.." % path)
         if f is None:
             self.log.error("Unknown or unsupported distribution")
-            sys.exit(1)
+            raise IOError("Couldn't identify the distribution on %s" % self.ssh.host)
 
         if 'os-release' in f:
             self.log.debug("Parsing os-release")
@@ -85,5 +84,8 @@ class Cluster(object):
             distro = "Debian" + relVer
         elif relName in ["Ubuntu"]:
             distro = "Ubuntu" + relVer
+        else:
+            self.log.error("Unknown or unsupported distribution")
+            raise IOError("Unsupported distribution %s %s on %s" % (relName, relVer, self.ssh.host))
 
         return distro
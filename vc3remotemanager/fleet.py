@@ -0,0 +1,189 @@
+import fnmatch
+import logging
+import os
+import threading
+import time
+
+from vc3remotemanager.scheduler import Scheduler
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+def load_clusters(clusterlist):
+    """
+    Parse the cluster list into a list of (login, host, lrms, alternates)
+    tuples
+    """
+    # example:
+    # entry=ruc.mwt2@mwt2-gk.campuscluster.illinois.edu max_queued=-1 cluster_type=condor
+    # alternate login nodes for the same cluster may be appended by hand:
+    # entry=lincolnb@cori.nersc.gov max_queued=-1 cluster_type=slurm alternates=cori01.nersc.gov,cori02.nersc.gov
+    clusters = []
+    if not os.path.isfile(clusterlist):
+        return clusters
+
+    with open(clusterlist, 'r') as f:
+        for line in f:
+            fields = dict(item.split('=', 1) for item in line.split() if '=' in item)
+            entry = fields.get('entry')
+            if entry is None or '@' not in entry:
+                continue
+            login, host = entry.split('@', 1)
+            alternates = [a for a in fields.get('alternates', '').split(',') if a]
+            clusters.append((login, host, fields.get('cluster_type'), alternates))
+    return clusters
+
+def select_clusters(clusters, lrms=None, login=None, host=None):
+    """
+    Filter clusters by batch system, login name and a shell-style host
+    pattern. Unset criteria match everything.
+    """
+    selected = []
+    for c in clusters:
+        if lrms is not None and c[2] != lrms:
+            continue
+        if login is not None and c[0] != login:
+            continue
+        if host is not None and not fnmatch.fnmatch(c[1], host):
+            continue
+        selected.append(c)
+    return selected
+
+class FleetResult(object):
+    """
+    Outcome of a command on a single cluster
+    """
+    def __init__(self, login, host, lrms, alternates=()):
+        self.login      = login
+        self.host       = host
+        self.lrms       = lrms
+        self.alternates = list(alternates)
+        self.served_by  = None
+        self.status  = None
+        self.out     = ''
+        self.err     = ''
+        self.error   = None
+        self.elapsed = None
+
+    @property
+    def entry(self):
+        return self.login + "@" + self.host
+
+    @property
+    def ok(self):
+        return self.error is None and self.status == 0
+
+class Fleet(object):
+    """
+    Run a command across many registered clusters at once
+    """
+    def __init__(self, **kwargs):
+        self.clusters  = kwargs.get('clusters', [])
+        self.connect   = kwargs.get('connect', None)  # callable(login, host) -> SSHManager
+        self.parallel  = int(kwargs.get('parallel', 10))
+        self.timeout   = kwargs.get('timeout', 60)
+        self.deadline  = kwargs.get('deadline', None)  # seconds for the whole run
+        self.scheduler = kwargs.get('scheduler', None) or Scheduler(timeout=self.timeout)
+        self.log       = logging.getLogger(__name__)
+
+        if self.connect is None:
+            self.log.debug("Missing required option connect: %s" % self.connect)
+
+    def run(self, cmd, callback=None, script=None):
+        """
+        Execute cmd on every cluster with at most self.parallel in flight.
+        If script is given, that local file is copied to each cluster and
+        run with sh instead. callback is invoked from the calling thread
+        with each FleetResult as it completes. Returns the results in
+        cluster order.
+        """
+        jobs    = queue.Queue()
+        done    = queue.Queue()
+        results = []
+        for c in self.clusters:
+            r = FleetResult(*c)
+            results.append(r)
+            jobs.put(r)
+
+        deadline = None
+        if self.deadline is not None:
+            deadline = time.time() + self.deadline
+
+        for _ in range(min(self.parallel, len(results))):
+            w = threading.Thread(target=self._worker, args=(jobs, done, cmd, script, deadline))
+            w.daemon = True
+            w.start()
+
+        for _ in range(len(results)):
+            r = done.get()
+            if callback is not None:
+                callback(r)
+
+        return results
+
+    def _worker(self, jobs, done, cmd, script, deadline):
+        while True:
+            try:
+                r = jobs.get_nowait()
+            except queue.Empty:
+                return
+
+            start = time.time()
+            step = lambda host, r=r: self._execute(r, host, cmd, script)
+            try:
+                r.served_by, (r.status, r.out, r.err) = self.scheduler.call(
+                    r.entry, [r.host] + r.alternates, step, deadline)
+            except Exception as e:
+                r.error = str(e) or e.__class__.__name__
+                self.log.warn("%s failed: %s" % (r.entry, r.error))
+            r.elapsed = time.time() - start
+            done.put(r)
+
+    def _execute(self, r, host, cmd, script):
+        ssh = None
+        try:
+            ssh = self.connect(r.login, host)
+            if script is not None:
+                # stage the script in $HOME and clean it up in the same
+                # invocation so we don't pay for a second round trip. Hedged
+                # and retried attempts may share $HOME, so each gets its own
+                # file
+                dst, err = ssh.remote_cmd("mktemp $HOME/.vc3-fleet-XXXXXXXX")
+                if not dst:
+                    self.log.debug(err)
+                    raise IOError("Couldn't stage %s on %s" % (script, host))
+                ssh.sftp.put(script, dst)
+                cmd = "sh %s; rc=$?; rm -f %s; exit $rc" % (dst, dst)
+            return ssh.remote_exec(cmd)
+        finally:
+            if ssh is not None:
+                try:
+                    ssh.cleanup()
+                except Exception:
+                    pass
+
+    def summary(self, results):
+        """
+        Return a plain-text table of exit codes and latencies
+        """
+        lines = []
+        width = max([len(r.entry) for r in results] + [5])
+        lines.append("%-*s %-8s %8s" % (width, "entry", "status", "seconds"))
+        for r in results:
+            if r.error is not None:
+                status = "error"
+            else:
+                status = str(r.status)
+            elapsed = "%.2f" % r.elapsed if r.elapsed is not None else "-"
+            line = "%-*s %-8s %8s" % (width, r.entry, status, elapsed)
+            if r.error is not None:
+                line += "  " + r.error
+            elif r.served_by is not None and r.served_by != r.host:
+                line += "  via " + r.served_by
+            lines.append(line)
+
+        failed = len([r for r in results if not r.ok])
+        lines.append("%d clusters, %d ok, %d failed" % (len(results), len(results) - failed, failed))
+        return "\n".join(lines)
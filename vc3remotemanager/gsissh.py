@@ -4,7 +4,6 @@ import subprocess
 import distutils.spawn
 import pexpect
 import tempfile
-import shlex
 from sshbase import SSHBase
 
 class GSISSHManager(SSHBase):
@@ -32,21 +31,34 @@ class GSISSHManager(SSHBase):
         """
         Execute GSISSH command via suprocess
         """
+        _, out, err = self.remote_exec(cmd)
+
+        return out, err
+
+    def remote_exec(self, cmd):
+        """
+        Execute GSISSH command and return its exit status, stdout and stderr
+        """
         args  = [self.gsissh]
         args += ['-q']
         args += ['-o']
         args += ['StrictHostKeyChecking=no']
+        if self.timeout is not None:
+            args += ['-o']
+            args += ['ConnectTimeout=%d' % int(self.timeout)]
         args += ['-p']
         args += [str(self.port)]
         args += ['{user}@{host}'.format(user=self.login, host=self.host)]
-        args += shlex.split(cmd)
+        # hand the command to the remote shell untouched, as exec_command
+        # does for SSHManager, so quoting and pipelines survive
+        args += [cmd]
         
         p = subprocess.Popen(args, env=self.env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         out, err = p.communicate()
         out = out.rstrip()
         err = err.rstrip()
 
-        return out, err
+        return p.returncode, out, err
 
     def cleanup(self):
         """
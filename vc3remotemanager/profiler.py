@@ -0,0 +1,166 @@
+import contextlib
+import cProfile
+import errno
+import logging
+import os
+import pstats
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None # python < 3.4
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class PhaseProfiler(object):
+    """
+    Opt-in profiling of the phases of an install.
+
+    With mode 'cpu' each phase runs under cProfile; the raw stats and a
+    text report sorted by cumulative time are written per phase. With mode
+    'memory' each phase is bracketed by tracemalloc snapshots and the
+    report lists the biggest allocation growth along with the traced peak;
+    without tracemalloc only the growth of the process peak RSS is recorded.
+    Without a mode, phase() does nothing.
+    """
+    def __init__(self, **kwargs):
+        self.mode   = kwargs.get('mode', None)
+        self.outdir = kwargs.get('outdir', "vc3-profile")
+        self.top    = int(kwargs.get('top', 25))
+        self.log    = logging.getLogger(__name__)
+        self.phases = [] # (name, seconds, peak bytes or None)
+        self.maxrss = self._maxrss() # high-water mark before the current phase
+        self.threads = None # profiles from other threads during the current cpu phase
+
+        if self.mode not in (None, 'cpu', 'memory'):
+            raise ValueError("Unknown profile mode %s" % self.mode)
+
+        if self.mode == 'memory' and tracemalloc is None:
+            self.log.warn("tracemalloc is not available, only reporting peak RSS")
+
+        if self.mode is not None:
+            try:
+                os.makedirs(self.outdir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            self.log.info("Writing %s profiles to %s" % (self.mode, self.outdir))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self.mode is None:
+            yield
+            return
+
+        # phases are recorded from the finally blocks so that the summary of
+        # a failed install still shows the phase it failed in
+        start = time.time()
+        if self.mode == 'cpu':
+            prof = cProfile.Profile()
+            self.threads = []
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+                threads, self.threads = self.threads, None
+                self._write_cpu(name, prof, threads)
+                self._record(name, start, None)
+        elif tracemalloc is not None:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            try:
+                yield
+            finally:
+                after = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                if started:
+                    tracemalloc.stop()
+                self._write_memory(name, before, after, peak)
+                self._record(name, start, peak)
+        else:
+            # ru_maxrss only ever grows, so credit a phase with how far it
+            # pushed the process high-water mark rather than the mark itself
+            try:
+                yield
+            finally:
+                peak = None
+                maxrss = self._maxrss()
+                if maxrss is not None:
+                    peak = maxrss - self.maxrss
+                    self.maxrss = maxrss
+                self._record(name, start, peak)
+
+    def wrap(self, fn):
+        """
+        Return fn profiled into the current cpu phase. cProfile only sees
+        the thread it was enabled in, so steps handed to other threads need
+        their own profile, which is merged into the phase's report.
+        """
+        threads = self.threads
+        if threads is None:
+            return fn
+        def profiled(*args, **kwargs):
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                prof.disable()
+                threads.append(prof)
+        return profiled
+
+    def _record(self, name, start, peak):
+        elapsed = time.time() - start
+        self.phases.append((name, elapsed, peak))
+        self.log.debug("Phase %s took %.2fs" % (name, elapsed))
+
+    def _maxrss(self):
+        if resource is None:
+            return None
+        # kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _write_cpu(self, name, prof, threads):
+        with open(os.path.join(self.outdir, name + ".cpu.txt"), 'w') as f:
+            stats = pstats.Stats(prof, stream=f)
+            for t in threads:
+                stats.add(t)
+            stats.dump_stats(os.path.join(self.outdir, name + ".prof"))
+            stats.sort_stats('cumulative').print_stats(self.top)
+
+    def _write_memory(self, name, before, after, peak):
+        with open(os.path.join(self.outdir, name + ".memory.txt"), 'w') as f:
+            f.write("traced peak: %d bytes\n" % peak)
+            maxrss = self._maxrss()
+            if maxrss is not None:
+                f.write("process peak RSS so far: %d bytes\n" % maxrss)
+            f.write("\ntop %d allocation changes:\n" % self.top)
+            for stat in after.compare_to(before, 'lineno')[:self.top]:
+                f.write("%s\n" % stat)
+
+    def summary(self):
+        """
+        Write a per-phase summary and return its path
+        """
+        if self.mode is None:
+            return None
+        path = os.path.join(self.outdir, "summary.txt")
+        with open(path, 'w') as f:
+            if self.mode == 'memory' and tracemalloc is None:
+                column = "RSS growth"
+            else:
+                column = "peak bytes"
+            f.write("%-12s %10s %14s\n" % ("phase", "seconds", column))
+            for name, elapsed, peak in self.phases:
+                f.write("%-12s %10.2f %14s\n" % (name, elapsed, peak if peak is not None else "-"))
+        self.log.info("Profile summary written to %s" % path)
+        return path
@@ -0,0 +1,101 @@
+import logging
+
+# exit status of command() when there is no sandbox to look at
+MISSING = 3
+
+class SandboxPruner(object):
+    """
+    Report on and prune the ft-gahp sandbox (BOSCO_SANDBOX_DIR).
+
+    Everything happens in a single remote shell command so a site only
+    costs one round trip, and sizes come from a single find pass over the
+    sandbox. Top-level sandbox entries (one per job) not modified for
+    `days` days are removed, pausing for a second after every `rate`
+    removals to go easy on shared filesystems. With `dryrun` nothing is
+    removed and the report shows what would have been reclaimed.
+    """
+    def __init__(self, **kwargs):
+        self.sandbox = kwargs.get('sandbox', "~/.condor/bosco/sandbox")
+        self.days    = int(kwargs.get('days', 30))
+        self.dryrun  = kwargs.get('dryrun', False)
+        self.rate    = int(kwargs.get('rate', 0)) # removals per second, 0 for no limit
+        self.log     = logging.getLogger(__name__)
+
+    def command(self):
+        """
+        Return the remote command. Its last line of output is
+        "vc3-sandbox <kb> <inodes> <entries> <pruned kb> <pruned inodes> <pruned entries>",
+        or "vc3-sandbox missing" with exit status MISSING if the sandbox
+        doesn't exist.
+        """
+        if self.dryrun:
+            remove = ":"
+        else:
+            remove = 'rm -rf "./$e"'
+        if self.rate > 0:
+            throttle = "[ $((n %% %d)) -eq 0 ] && sleep 1" % self.rate
+        else:
+            throttle = ":"
+
+        # find lists each top-level entry before its contents, so awk knows
+        # whether everything under it is going away. The names of the old
+        # entries go to $list for removal. Equivalent to -mtime +days.
+        tally = ("find . -mindepth 1 -printf '%%k %%d %%T@ %%P\\n' | "
+                 "awk -v now=$now -v age=%d -v list=$list '"
+                     "{ k = $1; d = $2; t = $3 } "
+                     "d == 1 { ent++; old = (now - t >= age); "
+                         "if (old) { e = $0; sub(/^[^ ]+ [^ ]+ [^ ]+ /, \"\", e); print e > list; pe++ } } "
+                     "{ kb += k; ino++; if (old) { pk += k; pi++ } } "
+                     "END { printf \"%%d %%d %%d %%d %%d %%d\\n\", kb, ino, ent, pk, pi, pe }'"
+                 % ((self.days + 1) * 86400))
+
+        steps = [
+            "cd %s 2>/dev/null || { echo vc3-sandbox missing; exit %d; }" % (self.sandbox, MISSING),
+            "list=`mktemp`",
+            "now=`date +%s`",
+            "set -- `%s`" % tally,
+            "n=0",
+            "while IFS= read -r e; do %s; n=$((n + 1)); %s; done < $list" % (remove, throttle),
+            "rm -f $list",
+            "echo vc3-sandbox $1 $2 $3 $4 $5 $6",
+        ]
+        # run under sh whatever the login shell is, csh and tcsh included
+        script = "; ".join(steps)
+        return "sh -c '%s'" % script.replace("'", "'\\''")
+
+    def report(self, out):
+        """
+        Parse the output of command() into a dict, sizes in bytes. Returns
+        None if the sandbox is missing.
+        """
+        for line in reversed(out.splitlines()):
+            fields = line.split()
+            if fields[:2] == ["vc3-sandbox", "missing"]:
+                return None
+            if fields and fields[0] == "vc3-sandbox" and len(fields) == 7:
+                kb, inodes, entries, pkb, pinodes, pentries = [int(x) for x in fields[1:]]
+                return {
+                    'bytes':          kb * 1024,
+                    'inodes':         inodes,
+                    'entries':        entries,
+                    'pruned_bytes':   pkb * 1024,
+                    'pruned_inodes':  pinodes,
+                    'pruned_entries': pentries,
+                }
+        raise ValueError("no sandbox report in output")
+
+    def prune(self, ssh):
+        """
+        Run against a single site and return the report, None if it has no
+        sandbox
+        """
+        self.log.info("%s sandbox %s on %s (older than %d days)" %
+                      ("Checking" if self.dryrun else "Pruning", self.sandbox, ssh.host, self.days))
+        status, out, err = ssh.remote_exec(self.command())
+        if status == MISSING:
+            self.log.info("No sandbox %s on %s" % (self.sandbox, ssh.host))
+            return None
+        if status != 0:
+            self.log.debug(err)
+            raise IOError("Sandbox maintenance failed on %s" % ssh.host)
+        return self.report(out)
@@ -0,0 +1,240 @@
+import errno
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class StepTimeout(Exception):
+    """
+    A step did not finish before its timeout or deadline
+    """
+    pass
+
+class CircuitOpenError(Exception):
+    """
+    Every host for a site is currently marked bad
+    """
+    pass
+
+class CircuitBreaker(object):
+    """
+    Per-host circuit breakers. After `threshold` consecutive failures a host
+    is skipped for `cooldown` seconds, then a single trial request is let
+    through; success closes the breaker again. If `statefile` is set the
+    breaker state survives between runs.
+    """
+    def __init__(self, **kwargs):
+        self.threshold = int(kwargs.get('threshold', 3))
+        self.cooldown  = float(kwargs.get('cooldown', 300))
+        self.statefile = kwargs.get('statefile', None)
+        self.lock      = threading.Lock()
+        self.log       = logging.getLogger(__name__)
+        self.state     = {}  # host -> [consecutive failures, time opened]
+
+        if self.statefile is not None:
+            try:
+                with open(self.statefile, 'r') as f:
+                    self.state = json.load(f)
+            except (IOError, OSError, ValueError) as e:
+                self.log.debug("Starting with empty breaker state: %s" % e)
+
+    def available(self, host):
+        """
+        Whether allow() would let a request to host through, without
+        spending a half-open trial
+        """
+        with self.lock:
+            failures, opened = self.state.get(host, [0, None])
+            return failures < self.threshold or time.time() - opened >= self.cooldown
+
+    def allow(self, host):
+        with self.lock:
+            failures, opened = self.state.get(host, [0, None])
+            if failures < self.threshold:
+                return True
+            if time.time() - opened >= self.cooldown:
+                # half-open: let one trial through and hold the rest off for
+                # another cooldown
+                self.log.info("Circuit for %s is half-open, trying again" % host)
+                self.state[host] = [failures, time.time()]
+                self._save()
+                return True
+            return False
+
+    def success(self, host):
+        with self.lock:
+            if self.state.pop(host, None) is not None:
+                self.log.debug("Circuit for %s closed" % host)
+                self._save()
+
+    def failure(self, host):
+        with self.lock:
+            failures, opened = self.state.get(host, [0, None])
+            failures += 1
+            if failures >= self.threshold:
+                self.log.warn("Circuit for %s open after %d failures" % (host, failures))
+                opened = time.time()
+            self.state[host] = [failures, opened]
+            self._save()
+
+    def _save(self):
+        if self.statefile is None:
+            return
+        try:
+            d = os.path.dirname(self.statefile)
+            if d:
+                try:
+                    os.makedirs(d)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+            tmp = self.statefile + ".tmp"
+            with open(tmp, 'w') as f:
+                json.dump(self.state, f)
+            os.rename(tmp, self.statefile)
+        except (IOError, OSError) as e:
+            self.log.debug("Couldn't save breaker state to %s: %s" % (self.statefile, e))
+
+class Scheduler(object):
+    """
+    Run a step against a site with per-attempt timeouts, exponential backoff
+    between attempts, circuit breakers per host and hedged requests against
+    the site's alternate login nodes.
+    """
+    def __init__(self, **kwargs):
+        self.timeout    = kwargs.get('timeout', 60)       # per attempt
+        self.retries    = int(kwargs.get('retries', 0))
+        self.backoff    = float(kwargs.get('backoff', 1))  # first retry delay
+        self.maxbackoff = float(kwargs.get('maxbackoff', 30))
+        self.hedge      = kwargs.get('hedge', None)       # seconds before trying an alternate
+        self.breaker    = kwargs.get('breaker', None) or CircuitBreaker()
+        self.log        = logging.getLogger(__name__)
+
+    def call(self, site, hosts, step, deadline=None):
+        """
+        Run step(host) for the first host of `site` that answers and return
+        (host, result). `hosts` is the primary login node followed by any
+        alternates. `deadline` is an absolute time.time() after which no
+        further attempts are made.
+        """
+        last = StepTimeout("deadline passed before %s was tried" % site)
+        failed = False
+        for attempt in range(self.retries + 1):
+            if deadline is not None and time.time() >= deadline:
+                break
+            if attempt > 0:
+                delay = min(self.backoff * 2 ** (attempt - 1), self.maxbackoff)
+                delay *= random.uniform(0.5, 1.0)
+                if deadline is not None:
+                    if deadline - time.time() <= delay:
+                        self.log.debug("%s: no time left for another attempt" % site)
+                        break
+                self.log.info("%s: attempt %d failed (%s), retrying in %.1fs" % (site, attempt, last, delay))
+                time.sleep(delay)
+
+            # only look here; a half-open host's trial is spent when a
+            # request is actually launched against it
+            candidates = [h for h in hosts if self.breaker.available(h)]
+            try:
+                if not candidates:
+                    raise CircuitOpenError("circuit open for %s" % ", ".join(hosts))
+                return self._hedged(site, candidates, step, deadline)
+            except CircuitOpenError as e:
+                if failed:
+                    # keep the error that tripped the breaker
+                    raise CircuitOpenError("%s (last error: %s)" % (e, last))
+                raise
+            except StepTimeout as e:
+                last = e
+                failed = True
+                if deadline is not None and time.time() >= deadline:
+                    break
+            except Exception as e:
+                last = e
+                failed = True
+
+        raise last
+
+    def _hedged(self, site, candidates, step, deadline):
+        results  = queue.Queue()
+        inflight = set()
+        errors   = []
+
+        end = time.time() + self.timeout if self.timeout is not None else None
+        if deadline is not None:
+            end = deadline if end is None else min(end, deadline)
+
+        def launch():
+            # start the next waiting host the breaker lets through, return
+            # False if there is none. Abandoned threads report into this
+            # attempt's queue, which nobody reads once we have returned
+            while waiting:
+                host = waiting.pop(0)
+                if self.breaker.allow(host):
+                    break
+            else:
+                return False
+            def target():
+                # hand back everything, SystemExit included, so a step can't
+                # end its thread silently and look like a timeout
+                try:
+                    results.put((host, True, step(host)))
+                except BaseException as e:
+                    results.put((host, False, e))
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+            inflight.add(host)
+            return host
+
+        waiting = list(candidates)
+        if not launch():
+            raise CircuitOpenError("circuit open for %s" % ", ".join(candidates))
+        hedge_at = time.time() + self.hedge if self.hedge is not None else None
+
+        while True:
+            now = time.time()
+            if end is not None and now >= end:
+                break
+            wait = end - now if end is not None else None
+            if waiting and hedge_at is not None:
+                wait = hedge_at - now if wait is None else min(wait, hedge_at - now)
+
+            try:
+                host, ok, value = results.get(timeout=max(wait, 0) if wait is not None else None)
+            except queue.Empty:
+                if waiting and hedge_at is not None and time.time() >= hedge_at:
+                    host = launch()
+                    if host:
+                        self.log.info("%s: no answer yet, hedging against %s" % (site, host))
+                    hedge_at = time.time() + self.hedge
+                continue
+
+            inflight.discard(host)
+            if ok:
+                self.breaker.success(host)
+                return host, value
+            if not isinstance(value, Exception):
+                # SystemExit and friends are not the host's fault
+                raise value
+
+            self.log.debug("%s: %s failed: %s" % (site, host, value))
+            self.breaker.failure(host)
+            errors.append(value)
+            # fail over straight away rather than waiting for the hedge
+            if launch():
+                if hedge_at is not None:
+                    hedge_at = time.time() + self.hedge
+            elif not inflight:
+                raise errors[-1]
+
+        for host in inflight:
+            self.breaker.failure(host)
+        raise StepTimeout("timed out waiting for %s" % ", ".join(sorted(inflight)))
@@ -37,25 +37,38 @@ class SSHManager(SSHBase):
                 localaddr = (self.parent.host, self.parent.port)
                 destaddr = (self.host, self.port)
                 pchannel = ptransport.open_channel("direct-tcpip", destaddr, localaddr)
-                self.client.connect(hostname=self.host,port=int(self.port),username=self.login,pkey=k,sock=pchannel)
+                self.client.connect(hostname=self.host,port=int(self.port),username=self.login,pkey=k,sock=pchannel,timeout=self.timeout)
                 self.sftp = self.client.open_sftp()
             else:
-                self.client.connect(hostname=self.host,port=int(self.port),username=self.login,pkey=k)
+                self.client.connect(hostname=self.host,port=int(self.port),username=self.login,pkey=k,timeout=self.timeout)
                 self.sftp = self.client.open_sftp()
+            # a stalled transfer fails after timeout seconds without progress,
+            # however long the whole transfer takes
+            self.sftp.get_channel().settimeout(self.timeout)
         except Exception as e:
             self.log.debug(e)
             self.log.error("Failed to establish SSH connection")
+            raise
 
     def remote_cmd(self,cmd):
         """
         Wraps around exec_command for a bit nicer output
         """
+        _, out, err = self.remote_exec(cmd)
+
+        return out, err
+
+    def remote_exec(self,cmd):
+        """
+        Run cmd and return its exit status along with stdout and stderr
+        """
         self.log.debug("Executing command %s" % cmd)
-        (_,stdout,stderr) = self.client.exec_command(cmd)
+        (_,stdout,stderr) = self.client.exec_command(cmd, timeout=self.timeout)
         out = "".join(stdout.readlines()).rstrip()
         err = "".join(stderr.readlines()).rstrip()
+        status = stdout.channel.recv_exit_status()
 
-        return out, err
+        return status, out, err
 
     def cleanup(self):
         """
@@ -7,6 +7,7 @@ class SSHBase(object):
         self.login          = kwargs.get('login', getpass.getuser())
         self.port           = kwargs.get('port', '22')
         self.host           = kwargs.get('host', None)
+        self.timeout        = kwargs.get('timeout', None) # seconds, None waits forever
         self.log            = logging.getLogger(__name__)
 
     def remote_cmd(self,cmd):
@@ -15,6 +16,12 @@ class SSHBase(object):
         """
         pass
 
+    def remote_exec(self,cmd):
+        """
+        Like remote_cmd, but also return the exit status of the command
+        """
+        pass
+
     def cleanup(self):
         """
         Close SSH, SFTP connnections
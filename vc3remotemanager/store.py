@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import os
+import shutil
+import textwrap
+
+ASSEMBLE_SCRIPT = """\
+    #!/bin/sh
+    # generated by vc3-remote-manager: move new objects into the shared
+    # store and link this install's files to them
+    store=%(root)s
+    install=%(installdir)s
+    set -e
+    mkdir -p "$store/objects" "$store/installs"
+    for f in "$install"/bosco/.vc3-objects/*; do
+        [ -e "$f" ] || continue
+        h=`basename "$f"`
+        if [ -e "$store/objects/$h" ]; then
+            rm -f "$f"
+        else
+            # objects are shared, so they get the read-only mode in their name
+            chmod "${h##*-}" "$f"
+            mv "$f" "$store/objects/$h"
+        fi
+    done
+    rmdir "$install/bosco/.vc3-objects"
+    while read h rel; do
+        # an object we expected to find may have been collected meanwhile
+        if [ ! -e "$store/objects/$h" ]; then
+            echo "missing store object $h for $rel" >&2
+            exit 1
+        fi
+        dst="$install/$rel"
+        mkdir -p `dirname "$dst"`
+        rm -f "$dst"
+        ln "$store/objects/$h" "$dst" 2>/dev/null || ln -s "$store/objects/$h" "$dst"
+    done < "$install/bosco/.vc3-manifest"
+    echo "$install" > "$store/installs/%(key)s"
+    rm -f "$store/installs/%(key)s.pending" "$0"
+"""
+
+GC_SCRIPT = """\
+    #!/bin/sh
+    # generated by vc3-remote-manager: drop registrations for installs that
+    # are gone, then delete objects no live install refers to
+    store=%(root)s
+    cd "$store" || exit 1
+    refs=`mktemp`
+    # installs still being uploaded hold on to everything they listed;
+    # markers left behind by installs that never finished expire
+    find installs -name '*.pending' -mtime +%(expire)d -exec rm -f {} \\;
+    for reg in installs/*; do
+        [ -e "$reg" ] || continue
+        case "$reg" in
+            *.pending) cat "$reg" >> "$refs"; continue;;
+        esac
+        install=`cat "$reg"`
+        if [ -f "$install/bosco/.vc3-manifest" ]; then
+            cut -d' ' -f1 "$install/bosco/.vc3-manifest" >> "$refs"
+        else
+            rm -f "$reg"
+        fi
+    done
+    n=0
+    bytes=0
+    for f in objects/*; do
+        [ -e "$f" ] || continue
+        if ! grep -qx "`basename "$f"`" "$refs"; then
+            bytes=$((bytes + `wc -c < "$f"`))
+            n=$((n + 1))
+            rm -f "$f"
+        fi
+    done
+    rm -f "$refs" "$0"
+    echo "$n $bytes"
+"""
+
+class ContentStore(object):
+    """
+    Content-addressed file store shared by every install on a remote site.
+
+    Files under the managed directories are named by checksum and mode,
+    uploaded only if the store doesn't have them yet, and linked into each
+    install (hardlinks where possible, symlinks across filesystems). Objects
+    are shared, so they and the files linked to them are read-only. Every
+    install keeps a manifest of the objects it uses, which is what garbage
+    collection counts references against; an install that is still being
+    uploaded is covered by a pending registration instead.
+    """
+    def __init__(self, **kwargs):
+        self.ssh     = kwargs.get('SSHManager', None)
+        self.root    = kwargs.get('root', None)  # resolved remote path
+        self.managed = kwargs.get('managed', ['bosco/glite/lib'])
+        self.expire  = int(kwargs.get('expire', 1)) # days before gc drops a pending install
+        self.log     = logging.getLogger(__name__)
+
+        if self.ssh is None:
+            self.log.debug("Missing required option SSHManager: %s" % self.ssh)
+        if self.root is None:
+            self.log.debug("Missing required option root: %s" % self.root)
+
+    def digest(self, path):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h.hexdigest()
+
+    def objects(self):
+        """
+        Return the set of object names already in the remote store
+        """
+        out, err = self.ssh.remote_cmd("mkdir -p %s/objects %s/installs && ls %s/objects" %
+                                       (self.root, self.root, self.root))
+        if err != '':
+            self.log.debug(err)
+        return set(out.split())
+
+    def stage(self, bdir, installdir):
+        """
+        Pull the managed files out of the extracted bundle in bdir. Objects
+        the store is missing go to bosco/.vc3-objects, the rest are dropped.
+        A manifest and an assembly script are left under bosco/ to be run
+        once the bundle has been unpacked on the remote side.
+        """
+        manifest = []
+        for d in self.managed:
+            for path, _, filenames in os.walk(os.path.join(bdir, d)):
+                for filename in sorted(filenames):
+                    full = os.path.join(path, filename)
+                    if os.path.islink(full):
+                        continue
+                    # objects are hardlinked and shared, so installed files
+                    # end up read-only; name them by that mode
+                    mode = os.stat(full).st_mode & 0o555
+                    h = "%s-%o" % (self.digest(full), mode)
+                    manifest.append((h, os.path.relpath(full, bdir)))
+
+        # claim the objects before looking at what the store has, so a
+        # concurrent gc can't remove them between now and assembly
+        key = hashlib.sha1(installdir.encode('utf-8')).hexdigest()
+        self.register(key, set(h for h, _ in manifest))
+
+        present = self.objects()
+        objdir  = os.path.join(bdir, "bosco", ".vc3-objects")
+        os.makedirs(objdir)
+
+        staged = set()
+        saved  = 0
+        for h, rel in manifest:
+            full = os.path.join(bdir, rel)
+            if h in present or h in staged:
+                saved += os.path.getsize(full)
+                os.remove(full)
+            else:
+                shutil.move(full, os.path.join(objdir, h))
+                staged.add(h)
+
+        self.log.info("%d of %d store objects need uploading, skipping %d bytes" %
+                      (len(staged), len(manifest), saved))
+
+        with open(os.path.join(bdir, "bosco", ".vc3-manifest"), 'w') as f:
+            for h, rel in manifest:
+                f.write("%s %s\n" % (h, rel))
+
+        script = ASSEMBLE_SCRIPT % {'root': self.root, 'installdir': installdir, 'key': key}
+        with open(os.path.join(bdir, "bosco", ".vc3-assemble.sh"), 'w') as f:
+            f.write(textwrap.dedent(script))
+
+        return manifest
+
+    def register(self, key, hashes):
+        """
+        Leave a pending registration listing the objects an install is about
+        to use. gc() treats them as referenced until assembly replaces the
+        marker with the real registration.
+        """
+        out, err = self.ssh.remote_cmd("mkdir -p %s/objects %s/installs" % (self.root, self.root))
+        if err != '':
+            self.log.debug(err)
+        with self.ssh.sftp.open(os.path.join(self.root, "installs", key + ".pending"), 'wb') as f:
+            f.write("".join("%s\n" % h for h in sorted(hashes)).encode('utf-8'))
+
+    def assemble(self, installdir):
+        """
+        Run the assembly script left behind by stage()
+        """
+        self.log.info("Linking %s against content store %s" % (installdir, self.root))
+        status, _, err = self.ssh.remote_exec("sh %s/bosco/.vc3-assemble.sh" % installdir)
+        if status != 0:
+            self.log.debug(err)
+            raise IOError("Couldn't assemble %s from store %s" % (installdir, self.root))
+
+    def gc(self):
+        """
+        Remove objects that no live install refers to. Returns the number
+        of objects and bytes reclaimed.
+        """
+        gcfile = os.path.join(self.root, ".vc3-gc.sh")
+        with self.ssh.sftp.open(gcfile, 'wb') as f:
+            f.write(textwrap.dedent(GC_SCRIPT % {'root': self.root, 'expire': self.expire}).encode('utf-8'))
+
+        status, out, err = self.ssh.remote_exec("sh %s" % gcfile)
+        if status != 0:
+            self.log.debug(err)
+            raise IOError("Garbage collection of store %s failed" % self.root)
+
+        n, nbytes = [int(x) for x in out.split()[-2:]]
+        self.log.info("Removed %d unreferenced objects (%d bytes) from %s" % (n, nbytes, self.root))
+        return n, nbytes
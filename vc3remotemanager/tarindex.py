@@ -0,0 +1,267 @@
+from tarfile import TarFile, TarInfo
+
+import bisect
+import errno
+import json
+import logging
+import os
+import zlib
+
+INDEX_VERSION = 1
+
+class TarIndex(object):
+    """
+    Seekable index over a cached BOSCO tarball, built on first use.
+
+    The upstream .tar.gz is a single gzip stream, so reaching a member near
+    the end means inflating everything before it. Building the index
+    re-compresses the tarball once into a multi-member gzip file, cut every
+    `chunksize` uncompressed bytes, and records the (uncompressed,
+    compressed) offset of each cut as a restart point along with the header
+    offset of every tar member. Extraction then seeks to the nearest restart
+    point and only inflates the chunks holding the requested members.
+    """
+    def __init__(self, tarball, **kwargs):
+        self.tarball   = tarball
+        self.indexdir  = kwargs.get('indexdir', os.path.join(os.path.dirname(tarball), ".index"))
+        self.chunksize = kwargs.get('chunksize', 1024 * 1024)
+        self.log       = logging.getLogger(__name__)
+
+        base = os.path.basename(tarball)
+        self.idxfile  = os.path.join(self.indexdir, base + ".idx")
+        self.datafile = os.path.join(self.indexdir, base + ".seek")
+
+        self.checkpoints = None
+        self.members     = None
+
+    def load(self):
+        """
+        Read the persisted index, return False if it is missing or stale
+        """
+        try:
+            with open(self.idxfile, 'r') as f:
+                idx = json.load(f)
+            st = os.stat(self.tarball)
+            os.stat(self.datafile)
+        except (IOError, OSError, ValueError) as e:
+            self.log.debug("No usable index for %s: %s" % (self.tarball, e))
+            return False
+
+        if (idx.get('version') != INDEX_VERSION or
+                idx.get('size') != st.st_size or
+                idx.get('mtime') != int(st.st_mtime)):
+            self.log.debug("Index %s is stale, ignoring" % self.idxfile)
+            return False
+
+        self.checkpoints = idx['checkpoints']
+        self.members     = idx['members']
+        return True
+
+    def build(self):
+        """
+        Re-compress the tarball into restartable chunks and record the
+        offset of every member
+        """
+        try:
+            os.makedirs(self.indexdir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        self.log.debug("Building index for %s" % self.tarball)
+        st = os.stat(self.tarball)
+        tmpdata = self.datafile + ".tmp"
+        tmpidx  = self.idxfile + ".tmp"
+
+        checkpoints = self._chunk(tmpdata)
+
+        # walk the members off the chunked copy rather than with a 'r|gz'
+        # stream, whose buffering goes quadratic on compressible data and
+        # which has to inflate every byte to skip over member contents
+        members = {}
+        reader = SeekableGzipReader(tmpdata, checkpoints)
+        try:
+            for m in TarFile(fileobj=reader, mode='r'):
+                members[m.name] = m.offset
+        finally:
+            reader.close()
+
+        idx = {
+            'version':     INDEX_VERSION,
+            'size':        st.st_size,
+            'mtime':       int(st.st_mtime),
+            'chunksize':   self.chunksize,
+            'checkpoints': checkpoints,
+            'members':     members,
+        }
+        with open(tmpidx, 'w') as f:
+            json.dump(idx, f)
+
+        os.rename(tmpdata, self.datafile)
+        os.rename(tmpidx, self.idxfile)
+
+        self.checkpoints = checkpoints
+        self.members     = members
+        self.log.debug("Indexed %d members in %d chunks" % (len(members), len(checkpoints)))
+
+    def _chunk(self, outfile):
+        """
+        Inflate the tarball and write it back out as one gzip member per
+        chunk, returning the list of [uncompressed, compressed] restart
+        points
+        """
+        checkpoints = []
+        upos = 0
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending = b''
+
+        with open(self.tarball, 'rb') as src:
+            with open(outfile, 'wb') as dst:
+                while True:
+                    data = src.read(64 * 1024)
+                    if not data:
+                        break
+                    while data:
+                        # cap the output so a highly compressible stretch
+                        # can't balloon memory
+                        pending += d.decompress(data, self.chunksize)
+                        data = d.unconsumed_tail
+                        if getattr(d, 'eof', False) or d.unused_data:
+                            # concatenated gzip members upstream. A capped
+                            # call can end a member with input left in both
+                            # unconsumed_tail and unused_data; the latter is
+                            # what belongs to the next member.
+                            data = d.unused_data
+                            d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                        while len(pending) >= self.chunksize:
+                            checkpoints.append([upos, dst.tell()])
+                            dst.write(self._compress(pending[:self.chunksize]))
+                            upos += self.chunksize
+                            pending = pending[self.chunksize:]
+                pending += d.flush()
+                if pending:
+                    checkpoints.append([upos, dst.tell()])
+                    dst.write(self._compress(pending))
+
+        return checkpoints
+
+    def _compress(self, data):
+        c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return c.compress(data) + c.flush()
+
+    def names(self):
+        return list(self.members.keys())
+
+    def extract(self, names, path):
+        """
+        Extract the named members to path, inflating only the chunks they
+        live in
+        """
+        reader = SeekableGzipReader(self.datafile, self.checkpoints)
+        try:
+            t = TarFile(fileobj=reader, mode='r')
+            members = []
+            for name in sorted(names, key=lambda n: self.members[n]):
+                offset = self.members[name]
+                reader.seek(offset)
+                t.offset = offset
+                members.append(TarInfo.fromtarfile(t))
+            t.extractall(path, members)
+        finally:
+            reader.close()
+
+class SeekableGzipReader(object):
+    """
+    Read-only file object over a multi-member gzip file with known restart
+    points
+    """
+    blocksize = 64 * 1024
+
+    def __init__(self, path, checkpoints):
+        self.name    = path
+        self.fh      = open(path, 'rb')
+        self.ustarts = [c[0] for c in checkpoints]
+        self.cstarts = [c[1] for c in checkpoints]
+        self.pos     = 0
+        self.block   = b''  # last inflated block, at most blocksize bytes
+        self.offset  = 0    # read offset into self.block
+        self.tail    = b''  # compressed input not yet fed to self.d
+        self.d       = None
+
+    def _restart(self, offset):
+        i = max(bisect.bisect_right(self.ustarts, offset) - 1, 0)
+        self.fh.seek(self.cstarts[i])
+        self.d      = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.pos    = self.ustarts[i]
+        self.block  = b''
+        self.offset = 0
+        self.tail   = b''
+
+    def _inflate(self):
+        """
+        Replace self.block with the next block of output, return False at
+        the end of the file
+        """
+        if self.d is None:
+            self._restart(self.pos)
+        while True:
+            data = self.tail or self.fh.read(self.blocksize)
+            if not data:
+                return False
+            out = self.d.decompress(data, self.blocksize)
+            self.tail = self.d.unconsumed_tail
+            if getattr(self.d, 'eof', False) or self.d.unused_data:
+                # start of the next chunk. When the output cap is hit right
+                # at the end of a member both unconsumed_tail and
+                # unused_data are set; the next member is in unused_data.
+                self.tail = self.d.unused_data
+                self.d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if out:
+                self.block  = out
+                self.offset = 0
+                return True
+
+    def _take(self, size, keep=True):
+        """
+        Consume up to size bytes (all remaining if size is None), returning
+        them as a list of pieces if keep is set
+        """
+        pieces = []
+        while size is None or size > 0:
+            if self.offset >= len(self.block) and not self._inflate():
+                break
+            n = len(self.block) - self.offset
+            if size is not None:
+                n = min(n, size)
+                size -= n
+            if keep:
+                pieces.append(self.block[self.offset:self.offset + n])
+            self.offset += n
+            self.pos += n
+        return pieces
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = None
+        return b''.join(self._take(size))
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            raise IOError("seeking from the end is not supported")
+
+        # skip forward inside the current chunk, otherwise jump to the
+        # nearest restart point
+        same = (self.d is not None and offset >= self.pos and
+                bisect.bisect_right(self.ustarts, offset) == bisect.bisect_right(self.ustarts, self.pos))
+        if not same:
+            self._restart(offset)
+        self._take(offset - self.pos, keep=False)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.fh.close()